@@ -1,14 +1,43 @@
 import os
+import sys
+import json
 import time
 import logging
+import logging.handlers
+import queue
+import atexit
 import random
 import math
+import heapq
+import itertools
 import re
+import socket
+import ssl
+import tempfile
 import requests
+import urllib3
 import threading
+from collections import deque
+from dataclasses import dataclass, replace
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj)
+
+    json_loads = orjson.loads
+except ImportError:  # stdlib fallback; same compact bytes output
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    json_loads = json.loads
 
 # ---------------------- config (env-friendly) ----------------------
 BINANCE_P2P_URL = os.getenv("BINANCE_P2P_URL", "https://p2p.binance.com/bapi/c2c/v2/friendly/c2c/adv/search")
@@ -16,20 +45,37 @@ ROWS_PER_REQUEST = int(os.getenv("ROWS_PER_REQUEST", "20"))
 FAST_PROBE_ROWS = int(os.getenv("FAST_PROBE_ROWS", "1"))  # rows for the fast probe
 TIMEOUT = int(os.getenv("TIMEOUT", "10"))
 MAX_SCAN_PAGES = int(os.getenv("MAX_SCAN_PAGES", "8"))
-
-# delays that control request pacing and staggering
-SLEEP_BETWEEN_PAGES = float(os.getenv("SLEEP_BETWEEN_PAGES", "0.15"))
-SLEEP_BETWEEN_PAIRS = float(os.getenv("SLEEP_BETWEEN_PAIRS", "0.30"))
-
-# rate-limiter / backoff tuning
+PAGE_BATCH_SIZE = int(os.getenv("PAGE_BATCH_SIZE", "4"))  # pages fetched in parallel per side during a full scan
+if PAGE_BATCH_SIZE <= 0:  # 0 == fetch all MAX_SCAN_PAGES at once
+    PAGE_BATCH_SIZE = MAX_SCAN_PAGES
+# opt-in heuristic: give up if page 1's smallest min > factor x threshold (0 = off). Ads are sorted
+# by price, not by limits, so this can miss a qualifying ad on a later page; see find_first_ad
+EARLY_EXIT_MIN_FACTOR = float(os.getenv("EARLY_EXIT_MIN_FACTOR", "0"))
+NO_MATCH_TTL_SECONDS = float(os.getenv("NO_MATCH_TTL_SECONDS", "60"))  # skip a side after an early give-up
+PROBE_ROWS = int(os.getenv("PROBE_ROWS", "5"))  # top-of-book rows used to fingerprint a side
+FINGERPRINT_TTL_SECONDS = float(os.getenv("FINGERPRINT_TTL_SECONDS", "300"))  # force a full scan after this
+# per-currency reuse window for a side's search result: slow books (EGP, MAD, KWD) can be cached longer
+DEFAULT_AD_CACHE_TTL = float(os.getenv("DEFAULT_AD_CACHE_TTL", "30"))
+AD_CACHE_TTLS_ENV = os.getenv("AD_CACHE_TTLS", "USD=15;EUR=15;GBP=15;EGP=60;MAD=120;KWD=120").strip()
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "64"))
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "3"))  # reuse a fetched page this long (0 disables)
+
+# rate-limiter / backoff tuning (all request pacing goes through the global token bucket)
 REQUESTS_PER_MINUTE = int(os.getenv("REQUESTS_PER_MINUTE", "20"))
 MAX_CONCURRENT_WORKERS = int(os.getenv("MAX_CONCURRENT_WORKERS", "2"))
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", "16"))  # cap on concurrent Binance POSTs
+AIMD_INCREASE = float(os.getenv("AIMD_INCREASE", "0.5"))  # in-flight limit added per window of successes
+AIMD_DECREASE = float(os.getenv("AIMD_DECREASE", "0.5"))  # in-flight limit multiplier on 429/5xx/timeout
 MAX_FETCH_RETRIES_ON_429 = int(os.getenv("MAX_FETCH_RETRIES_ON_429", "5"))
 INITIAL_BACKOFF_SECONDS = float(os.getenv("INITIAL_BACKOFF_SECONDS", "1.0"))
 MAX_BACKOFF_SECONDS = float(os.getenv("MAX_BACKOFF_SECONDS", "60.0"))
+ERROR_WINDOW_SECONDS = float(os.getenv("ERROR_WINDOW_SECONDS", "60"))  # window for the 429/503 rate that scales backoff
 JITTER_FACTOR = float(os.getenv("JITTER_FACTOR", "0.25"))
 MAX_CONSECUTIVE_429_BEFORE_COOLDOWN = int(os.getenv("MAX_CONSECUTIVE_429_BEFORE_COOLDOWN", "8"))
 EXTENDED_COOLDOWN_SECONDS = int(os.getenv("EXTENDED_COOLDOWN_SECONDS", "300"))
+BINANCE_WEIGHT_LIMIT_1M = int(os.getenv("BINANCE_WEIGHT_LIMIT_1M", "1200"))  # request weight per minute
+RATE_LIMIT_PAUSE_FRACTION = float(os.getenv("RATE_LIMIT_PAUSE_FRACTION", "0.9"))  # pause once this share is used
+RATE_LIMIT_MIN_REMAINING = int(os.getenv("RATE_LIMIT_MIN_REMAINING", "2"))
 
 # tolerance for float comparisons to avoid duplicate alerts due to tiny rounding diffs
 ALERT_VALUE_TOLERANCE = float(os.getenv("ALERT_VALUE_TOLERANCE", "0.0001"))
@@ -38,16 +84,32 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "").strip()
 TELEGRAM_IMAGE_URL = os.getenv("TELEGRAM_IMAGE_URL", "https://i.ibb.co/67XZq1QL/212.png").strip()
 TELEGRAM_IMAGE_FILE_ID = os.getenv("TELEGRAM_IMAGE_FILE_ID", "").strip()
+TELEGRAM_FILE_ID_CACHE = os.getenv("TELEGRAM_FILE_ID_CACHE", os.path.expanduser("~/.cache/p2pbot/photo_id")).strip()
+
+TELEGRAM_BATCH_ALERTS = os.getenv("TELEGRAM_BATCH_ALERTS", "1").strip()  # "1" = flush a cycle's alerts as media groups
+TELEGRAM_MEDIA_GROUP_MAX = 10  # Telegram accepts 2-10 items per sendMediaGroup
 
 ALERT_TTL_SECONDS = int(os.getenv("ALERT_TTL_SECONDS", "0"))
 ALERT_DEDUP_MODE = os.getenv("ALERT_DEDUP_MODE", "exact").lower()
+# idle pair state (no live alert, nothing sent for this long) and expired cache entries are dropped
+STATE_TTL_SECONDS = float(os.getenv("STATE_TTL_SECONDS", "86400"))
+STATE_PRUNE_EVERY = 60.0
 
 REFRESH_EVERY = int(os.getenv("REFRESH_EVERY", "120"))
+# adaptive per-pair scheduling: delay = REFRESH_EVERY * exp(-EWMA(|Δspread|)), clamped
+MIN_REFRESH_SECONDS = float(os.getenv("MIN_REFRESH_SECONDS", "30"))
+MAX_REFRESH_SECONDS = float(os.getenv("MAX_REFRESH_SECONDS", "300"))
+VOLATILITY_EWMA_ALPHA = float(os.getenv("VOLATILITY_EWMA_ALPHA", "0.3"))
 PROFIT_THRESHOLD_PERCENT = float(os.getenv("PROFIT_THRESHOLD_PERCENT", "3"))
+# skip the SELL-side scan when the BUY side + last tick's buy price is this far below threshold
+SKIP_SECOND_SIDE_MARGIN_PERCENT = float(os.getenv("SKIP_SECOND_SIDE_MARGIN_PERCENT", "1.0"))
 
 ALERT_UPDATE_ON_ANY_CHANGE = os.getenv("ALERT_UPDATE_ON_ANY_CHANGE", "1").strip()
 ALERT_UPDATE_MIN_DELTA_PERCENT = float(os.getenv("ALERT_UPDATE_MIN_DELTA_PERCENT", "0.01"))
 ALERT_UPDATE_PRICE_CHANGE_PERCENT = float(os.getenv("ALERT_UPDATE_PRICE_CHANGE_PERCENT", "0.05"))
+# mode switches resolved once instead of string compares per should_send_update call
+UPDATE_ON_ANY_CHANGE = ALERT_UPDATE_ON_ANY_CHANGE == "1"
+EXACT_DEDUP = ALERT_DEDUP_MODE == "exact"
 
 # new envs: min & max defaults + per-currency thresholds
 DEFAULT_MIN_LIMIT = float(os.getenv("DEFAULT_MIN_LIMIT", "100"))
@@ -93,15 +155,52 @@ friendly_pay_names = {
     "DukascopyBank": "Dukascopy Bank", "Ahlibank": "Ahlibank", "BanqueMisr": "Banque Misr",
 }
 
+# per-currency O(1) membership for method validation
+payment_methods_index = {cur: frozenset(methods) for cur, methods in payment_methods_map.items()}
+
 # ---------------------- logging ----------------------
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# Worker threads only enqueue records; a background listener does the stream I/O.
+# Like basicConfig, leave an already-configured root logger alone.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").strip().upper()
+# getLevelName maps a known name to its number and anything else to a "Level X" string
+log_level = logging.getLevelName(LOG_LEVEL)
+log_level_valid = isinstance(log_level, int)
+if not log_level_valid:
+    log_level = logging.INFO
+root_logger = logging.getLogger()
+if not root_logger.handlers:
+    root_logger.setLevel(log_level)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    if not log_level_valid:
+        logging.warning(f"Invalid LOG_LEVEL {LOG_LEVEL!r}, using INFO")
 
 # ---------------------- helpers ----------------------
 
 def safe_float(val, default=0.0):
+    t = type(val)
+    if t is float:
+        return val
+    if t is int:
+        return float(val)
+    if t is str:
+        try:
+            return float(val)  # plain numeric strings, as Binance sends them
+        except ValueError:
+            pass
+    if val is None:
+        return float(default)
+    return _slow_parse_float(val, default)
+
+
+def _slow_parse_float(val, default):
+    """Lenient parse for values like "1,234.5 EGP"; falls back to `default`."""
     try:
-        if val is None:
-            return float(default)
         if isinstance(val, (int, float)):
             return float(val)
         s = str(val).strip().replace(",", "")
@@ -131,6 +230,9 @@ def parse_thresholds(env_str, currencies, default_value):
     return out
 
 
+METHOD_NORM_RE = re.compile(r'[^0-9a-z]')
+
+
 def parse_profit_thresholds(env_str):
     """
     Parse PROFIT_THRESHOLDS into lookup maps.
@@ -141,7 +243,7 @@ def parse_profit_thresholds(env_str):
       - DEFAULT=val
     """
     def norm_cur(c): return c.strip().upper()
-    def norm_method(m): return re.sub(r'[^0-9a-z]', '', m.strip().lower())
+    def norm_method(m): return METHOD_NORM_RE.sub('', m.strip().lower())
 
     exact = {}   # (cur, method_norm) -> float
     cur_map = {} # cur -> float
@@ -178,17 +280,20 @@ def parse_profit_thresholds(env_str):
 def normalize_method_name(m):
     if not m:
         return ""
-    return re.sub(r'[^0-9a-z]', '', str(m).strip().lower())
+    return METHOD_NORM_RE.sub('', str(m).strip().lower())
 
 
 # ---------------------- parse new envs ----------------------
 exact_profit_map, profit_cur_map, profit_method_map, profit_default = parse_profit_thresholds(PROFIT_THRESHOLDS_ENV)
+ad_cache_ttls = parse_thresholds(AD_CACHE_TTLS_ENV, currency_list, DEFAULT_AD_CACHE_TTL)
 
 allowed_methods_set = set([normalize_method_name(x) for x in PAYMENT_METHODS_ENV.split(",") if x.strip()]) if PAYMENT_METHODS_ENV else set()
 exclude_methods_set = set([normalize_method_name(x) for x in EXCLUDE_PAYMENT_METHODS_ENV.split(",") if x.strip()]) if EXCLUDE_PAYMENT_METHODS_ENV else set()
 
 def method_allowed(method):
     """Return True if method is allowed given whitelist/exclude. Matches against friendly names too."""
+    if not allowed_methods_set and not exclude_methods_set:
+        return True
     norm = normalize_method_name(method)
     friendly = normalize_method_name(friendly_pay_names.get(method, ""))
     candidates = {norm, friendly}
@@ -217,67 +322,227 @@ def get_profit_threshold(cur, method):
 
 
 # ---------------------- HTTP session ----------------------
-session = requests.Session()
-retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
-session.mount("https://", HTTPAdapter(max_retries=retries))
-HEADERS = {"Content-Type": "application/json", "User-Agent": "Mozilla/5.0 (compatible; ArbitrageChecker/1.0)"}
-
-# ---------------------- global rate-limiter state (token bucket) ----------------------
-token_bucket = {
-    "tokens": float(max(1, REQUESTS_PER_MINUTE)),  # start with full bucket
-    "last_refill": time.time()
-}
-token_lock = threading.Lock()
+KEEPALIVE_SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled sockets use TCP_NODELAY + SO_KEEPALIVE."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = KEEPALIVE_SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+class BinanceStatusError(urllib3.exceptions.HTTPError):
+    """HTTP error status from Binance other than the throttling ones (429/503)."""
+
+
+# Binance hot path: one pre-built urllib3 pool for the single Binance host, which skips
+# requests' per-call URL parsing, adapter dispatch and cookie handling.
+# No urllib3-level retries: every retry (and its backoff) is decided in fetch_page_raw.
+# block=True: wait for a pooled connection instead of opening throwaway ones (each costs a TLS handshake)
+HEADERS = {"Content-Type": "application/json", "User-Agent": "Mozilla/5.0 (compatible; ArbitrageChecker/1.0)", "Connection": "keep-alive"}
+BINANCE_P2P_PATH = urllib3.util.parse_url(BINANCE_P2P_URL).request_uri
+# HEADERS are the pool's defaults, so calls do not pass (or copy) them per request
+# never more pooled connections than requests the AIMD limiter lets in flight at once
+binance_pool_kw = {"maxsize": max(1, min(HTTP_POOL_MAXSIZE, MAX_INFLIGHT_REQUESTS)), "block": True, "retries": False, "headers": HEADERS,
+                   "timeout": urllib3.Timeout(total=TIMEOUT), "socket_options": KEEPALIVE_SOCKET_OPTIONS}
+if BINANCE_P2P_URL.startswith("https"):
+    # One TLS context for every pooled connection: the CA bundle is loaded once instead of per
+    # connection, and session tickets stay enabled (OP_NO_TICKET is not set).
+    tls_context = ssl.create_default_context(cafile=requests.certs.where())
+    binance_pool_kw["ssl_context"] = tls_context
+binance_pool = urllib3.connection_from_url(BINANCE_P2P_URL, **binance_pool_kw)
+
+# Telegram: separate session with the more patient retry policy (different SLA)
+tg_session = requests.Session()
+tg_retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+tg_session.mount("https://", KeepAliveAdapter(pool_block=True, max_retries=tg_retries))
+TELEGRAM_API_BASE = "https://api.telegram.org"
+
+
+def warm_connections():
+    """Open keep-alive connections (DNS + TCP + TLS) to both hosts before the first cycle."""
+    try:
+        binance_pool.urlopen("HEAD", BINANCE_P2P_PATH)
+    except urllib3.exceptions.HTTPError as e:
+        logging.debug(f"Connection warm-up failed for {BINANCE_P2P_URL}: {e}")
+    try:
+        tg_session.head(TELEGRAM_API_BASE, timeout=TIMEOUT)
+    except requests.RequestException as e:
+        logging.debug(f"Connection warm-up failed for {TELEGRAM_API_BASE}: {e}")
+
+# ---------------------- global request pacing ----------------------
+# next() on itertools.count is atomic, so 429 bookkeeping needs no lock; a reset swaps in a
+# fresh counter. consecutive_429_count mirrors the latest value for lock-free readers.
+c429_counter = itertools.count(1)
+consecutive_429_count = 0
 
+MIN_INTERVAL_BASE = max(0.0, 60.0 / max(1, REQUESTS_PER_MINUTE))
+next_request_ts = time.monotonic()
+throttle_lock = threading.Lock()
+
+
+def throttle():
+    """Reserve the next request slot (spaced by RPM, widened after repeated 429s) and sleep until it."""
+    global next_request_ts
+    c429 = consecutive_429_count
+    multiplier = 1.0 if c429 <= 2 else min(64, 2 ** (c429 - 1))
+    with throttle_lock:
+        now = time.monotonic()
+        slot = max(next_request_ts, now)
+        next_request_ts = slot + MIN_INTERVAL_BASE * multiplier
+    wait = slot - now
+    if wait > 0:
+        logging.debug("Rate limiter: sleeping %.3fs for the next request slot (mult=%s)", wait, multiplier)
+        time.sleep(wait)
+
+
+def defer_slots(until):
+    """Move the next free request slot to `until` (monotonic) so slots reserved later stay spaced after a pause."""
+    global next_request_ts
+    with throttle_lock:
+        if until > next_request_ts:
+            next_request_ts = until
+
+class AIMDLimiter:
+    """
+    Adaptive cap on outstanding Binance requests across all worker threads.
+    Additive increase (AIMD_INCREASE per `limit` successes), multiplicative decrease
+    (x AIMD_DECREASE) on 429/5xx/network errors, clamped to [1, MAX_INFLIGHT_REQUESTS].
+    """
 
-def acquire_token_blocking():
-    while True:
-        with token_lock:
-            now = time.time()
-            elapsed = now - token_bucket["last_refill"]
-            if elapsed > 0:
-                refill = (elapsed / 60.0) * REQUESTS_PER_MINUTE
-                token_bucket["tokens"] = min(float(REQUESTS_PER_MINUTE), token_bucket["tokens"] + refill)
-                token_bucket["last_refill"] = now
+    def __init__(self, max_limit, increase=AIMD_INCREASE, decrease=AIMD_DECREASE):
+        self.max_limit = float(max(1, max_limit))
+        self.limit = self.max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    def __enter__(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify()
+        return False
 
-            if token_bucket["tokens"] >= 1.0:
-                token_bucket["tokens"] -= 1.0
-                return True
+    def on_success(self):
+        with self.cond:
+            old = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            if int(self.limit) > old:
+                self.cond.notify_all()
 
-            sec_per_token = 60.0 / max(1, REQUESTS_PER_MINUTE)
-            to_sleep = sec_per_token
-        logging.debug(f"Token bucket empty, sleeping {to_sleep:.3f}s")
-        time.sleep(to_sleep)
+    def on_error(self):
+        with self.cond:
+            self.limit = max(1.0, self.limit * self.decrease)
+        logging.debug("AIMD: in-flight limit cut to %.2f", self.limit)
 
-last_request_ts = [0.0]
-last_request_lock = threading.Lock()
-consecutive_429_count = 0
-consecutive_429_lock = threading.Lock()
 
-MIN_INTERVAL_BASE = max(0.0, 60.0 / max(1, REQUESTS_PER_MINUTE))
+inflight_limiter = AIMDLimiter(MAX_INFLIGHT_REQUESTS)
 
+class RateLimitTracker:
+    """
+    Reads rate-limit headers from every Binance response and pauses all fetchers
+    before the limit is hit: Retry-After is honored exactly, X-MBX-USED-WEIGHT-1M /
+    X-RateLimit-Remaining pause until the window resets. The throttle() pacer above
+    remains the fallback when the headers are absent.
+    """
 
-def rate_limit_wait():
-    with consecutive_429_lock:
-        c429 = consecutive_429_count
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resume_at = 0.0  # time.monotonic()
+
+    def pause_for(self, seconds, reason):
+        if seconds <= 0:
+            return
+        with self.lock:
+            until = time.monotonic() + seconds
+            if until <= self.resume_at:
+                return
+            self.resume_at = until
+        # the pacer hands out no slot before the pause ends
+        defer_slots(until)
+        logging.warning(f"Rate limiter: pausing all fetches for {seconds:.2f}s ({reason})")
+
+    def update(self, headers):
+        ra = headers.get("Retry-After")
+        if ra:
+            self.pause_for(parse_retry_after(ra), f"Retry-After={ra}")
+        until_next_minute = 60.0 - (time.time() % 60.0)
+        used = headers.get("X-MBX-USED-WEIGHT-1M") or headers.get("X-MBX-USED-WEIGHT")
+        if used and used.isdigit() and int(used) >= RATE_LIMIT_PAUSE_FRACTION * BINANCE_WEIGHT_LIMIT_1M:
+            self.pause_for(until_next_minute, f"used weight {used}/{BINANCE_WEIGHT_LIMIT_1M}")
+        remaining = headers.get("X-RateLimit-Remaining")
+        if remaining and remaining.isdigit() and int(remaining) <= RATE_LIMIT_MIN_REMAINING:
+            reset = headers.get("X-RateLimit-Reset")
+            wait = safe_float(reset, until_next_minute) if reset else until_next_minute
+            if wait > 3600:  # epoch timestamp rather than a delta
+                wait -= time.time()
+            self.pause_for(wait, f"remaining={remaining}")
+
+    def paused(self):
+        return self.resume_at > time.monotonic()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                to_sleep = self.resume_at - time.monotonic()
+            if to_sleep <= 0:
+                return
+            time.sleep(to_sleep)
 
-    cap = 64
-    if c429 <= 2:
-        multiplier = 1.0
-    else:
-        multiplier = min(cap, 2 ** (c429 - 1))
 
-    effective_min_interval = MIN_INTERVAL_BASE * multiplier
-    jitter = random.uniform(0, min(0.25 * effective_min_interval, 0.5))
+rate_limit_tracker = RateLimitTracker()
 
-    with last_request_lock:
-        now = time.time()
-        elapsed = now - last_request_ts[0]
-        if elapsed < (effective_min_interval + jitter):
-            to_sleep = (effective_min_interval + jitter) - elapsed
-            logging.debug(f"Rate limiter: sleeping {to_sleep:.3f}s to respect min interval (mult={multiplier})")
-            time.sleep(to_sleep)
-        last_request_ts[0] = time.time()
+
+class ErrorRateWindow:
+    """
+    Share of 429/503 responses over the last ERROR_WINDOW_SECONDS. backoff_base() grows
+    with it, so backoff stays short while the endpoint is healthy and stretches under
+    sustained throttling; old samples age out, so recovery is gradual.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = deque()  # (monotonic ts, is_error)
+        self.errors = 0
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self.samples and self.samples[0][0] < cutoff:
+            self.errors -= self.samples.popleft()[1]
+
+    def record(self, is_error):
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, is_error))
+            self.errors += is_error
+            self._expire(now)
+
+    def rate(self):
+        with self.lock:
+            self._expire(time.monotonic())
+            return self.errors / len(self.samples) if self.samples else 0.0
+
+
+error_window = ErrorRateWindow(ERROR_WINDOW_SECONDS)
+
+
+def backoff_base():
+    err = error_window.rate()
+    return INITIAL_BACKOFF_SECONDS * (1.0 + 10.0 * err * err)
 
 # ---------------------- helpers for value comparison ----------------------
 
@@ -291,128 +556,403 @@ def values_close(a, b, tol=ALERT_VALUE_TOLERANCE):
 
 # ---------------------- fetch (FIRST matching ad logic) with smart backoff ----------------------
 
-def fetch_page_raw(fiat, pay_type, trade_type, page, rows=ROWS_PER_REQUEST):
-    global consecutive_429_count
+# (fiat, pay_type, trade_type) -> bytes %-template of the JSON body with %d slots for page and rows
+payload_templates = {}
+
+def payload_body(fiat, pay_type, trade_type, page, rows):
+    """Serialized search payload; the JSON is encoded once per (pair, side) and page/rows are %-substituted."""
+    key = (fiat, pay_type, trade_type)
+    tpl = payload_templates.get(key)
+    if tpl is None:
+        raw = json_dumps({"asset": "USDT", "fiat": fiat, "tradeType": trade_type, "payTypes": [pay_type], "page": 0, "rows": 0})
+        tpl = payload_templates[key] = raw.replace(b"%", b"%%").replace(b'"page":0', b'"page":%d', 1).replace(b'"rows":0', b'"rows":%d', 1)
+    return tpl % (page, rows)
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date); 0.0 if absent or invalid."""
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return 0.0
+
+def run_coalesced(table, lock, key, fn, *args):
+    """Run fn(*args) once for all concurrent callers with the same key; the others wait on its Future."""
+    with lock:
+        fut = table.get(key)
+        owner = fut is None
+        if owner:
+            fut = table[key] = Future()
+    if not owner:
+        logging.debug("[coalesce] joining in-flight call for %s", key)
+        return fut.result()
+    try:
+        result = fn(*args)
+        fut.set_result(result)
+        return result
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with lock:
+            table.pop(key, None)
+
+# (fiat, pay_type, trade_type, page, rows) -> Future of the request in flight; results are shared read-only
+inflight_pages = {}
+inflight_pages_lock = threading.Lock()
+# same key -> (monotonic ts, items); only non-empty pages are kept, so failures are never reused
+page_cache = {}
 
-    payload = {"asset": "USDT", "fiat": fiat, "tradeType": trade_type, "payTypes": [pay_type], "page": page, "rows": rows}
+def fetch_page_raw(fiat, pay_type, trade_type, page, rows=ROWS_PER_REQUEST, cancel=None):
+    """
+    One search page. Identical concurrent requests (e.g. overlapping pairs) share a single
+    HTTP call, and a page fetched less than PAGE_CACHE_TTL seconds ago is reused as is.
+    Returns None without sending anything once the optional `cancel` Event is set.
+    """
+    key = (fiat, pay_type, trade_type, page, rows)
+    cached = page_cache.get(key)
+    if cached and time.monotonic() - cached[0] < PAGE_CACHE_TTL:
+        return cached[1]
+    items = run_coalesced(inflight_pages, inflight_pages_lock, key, _fetch_page, *key, cancel)
+    while items is None and not (cancel is not None and cancel.is_set()):
+        # joined a call whose own scan was cancelled: fetch it for ourselves
+        items = run_coalesced(inflight_pages, inflight_pages_lock, key, _fetch_page, *key, cancel)
+    if items and PAGE_CACHE_TTL > 0:
+        page_cache[key] = (time.monotonic(), items)
+    return items
+
+def _fetch_page(fiat, pay_type, trade_type, page, rows, cancel=None):
+    global consecutive_429_count, c429_counter
+
+    body = payload_body(fiat, pay_type, trade_type, page, rows)
 
     for attempt in range(1, MAX_FETCH_RETRIES_ON_429 + 1):
-        acquire_token_blocking()
-        rate_limit_wait()
+        if cancel is not None and cancel.is_set():
+            return None
+        while True:
+            rate_limit_tracker.wait()
+            throttle()
+            # a pause that started while this slot was asleep voids it: wait it out and
+            # take a fresh slot, which the pause has already pushed past its end
+            if not rate_limit_tracker.paused():
+                break
+        # the slot may have been a long sleep: re-check before spending a request on it
+        if cancel is not None and cancel.is_set():
+            return None
         try:
-            r = session.post(BINANCE_P2P_URL, json=payload, headers=HEADERS, timeout=TIMEOUT)
-            if r.status_code == 429:
-                with consecutive_429_lock:
-                    consecutive_429_count += 1
-                    c429_local = consecutive_429_count
+            with inflight_limiter:
+                r = binance_pool.urlopen("POST", BINANCE_P2P_PATH, body=body)
+            rate_limit_tracker.update(r.headers)
+            error_window.record(r.status in (429, 503))
+            if r.status == 429 or r.status >= 500:
+                inflight_limiter.on_error()
+            else:
+                inflight_limiter.on_success()
+            if r.status in (429, 503):
+                consecutive_429_count = c429_local = next(c429_counter)
 
-                ra = None
-                try:
-                    ra_hdr = r.headers.get("Retry-After")
-                    if ra_hdr:
-                        ra = float(ra_hdr)
-                except Exception:
-                    ra = None
+                # full jitter over an error-rate-scaled base, with the server's Retry-After as a hard floor
+                backoff = min(MAX_BACKOFF_SECONDS, backoff_base() * (2 ** (attempt - 1)))
+                wait = max(random.uniform(0, backoff), parse_retry_after(r.headers.get("Retry-After")))
 
-                backoff = min(MAX_BACKOFF_SECONDS, INITIAL_BACKOFF_SECONDS * (2 ** (attempt - 1)))
-                jitter = random.uniform(0, JITTER_FACTOR * backoff)
-                wait = backoff + jitter
-                if ra and ra > wait:
-                    wait = ra + random.uniform(0, 1.0)
-
-                logging.warning(f"Received 429 for {fiat}/{pay_type}/{trade_type} p{page} (attempt {attempt}/{MAX_FETCH_RETRIES_ON_429}). Sleeping {wait:.2f}s (consec429={c429_local})")
+                logging.warning(f"Received {r.status} for {fiat}/{pay_type}/{trade_type} p{page} (attempt {attempt}/{MAX_FETCH_RETRIES_ON_429}). Backing off {wait:.2f}s (consec429={c429_local})")
 
+                # pause every fetcher, not just this one, so concurrent retries do not defeat the limit
                 if c429_local >= MAX_CONSECUTIVE_429_BEFORE_COOLDOWN:
                     logging.warning(f"High consecutive 429s ({c429_local}) — entering extended cooldown for {EXTENDED_COOLDOWN_SECONDS}s")
-                    time.sleep(EXTENDED_COOLDOWN_SECONDS)
+                    rate_limit_tracker.pause_for(EXTENDED_COOLDOWN_SECONDS, "extended cooldown")
                 else:
-                    time.sleep(wait)
+                    rate_limit_tracker.pause_for(wait, f"HTTP {r.status}")
                 continue
 
-            r.raise_for_status()
+            if r.status >= 400:
+                raise BinanceStatusError(f"HTTP {r.status}")
 
-            with consecutive_429_lock:
+            if consecutive_429_count:
+                c429_counter = itertools.count(1)
                 consecutive_429_count = 0
 
             try:
-                j = r.json()
+                j = json_loads(r.data)
                 return j.get("data") or []
             except Exception:
-                logging.debug(f"Failed to parse JSON response for {fiat}/{pay_type}/{trade_type} p{page}")
+                logging.debug("Failed to parse JSON response for %s/%s/%s p%s", fiat, pay_type, trade_type, page)
                 return []
-        except requests.RequestException as e:
-            logging.debug(f"Network error {fiat} {pay_type} {trade_type} p{page} attempt {attempt}: {e}")
+        except urllib3.exceptions.HTTPError as e:
+            if not isinstance(e, BinanceStatusError):
+                inflight_limiter.on_error()  # HTTP errors were already counted above
+            logging.debug("Network error %s %s %s p%s attempt %s: %s", fiat, pay_type, trade_type, page, attempt, e)
             if attempt < MAX_FETCH_RETRIES_ON_429:
                 backoff = min(MAX_BACKOFF_SECONDS, INITIAL_BACKOFF_SECONDS * (2 ** (attempt - 1)))
                 jitter = random.uniform(0, JITTER_FACTOR * backoff)
                 wait = backoff + jitter
-                logging.debug(f"Retrying after {wait:.2f}s...")
+                logging.debug("Retrying after %.2fs...", wait)
                 time.sleep(wait)
                 continue
             else:
                 return []
     return []
 
+def ad_numbers(adv):
+    """Return (price, min_limit, max_limit) floats from an `adv` dict."""
+    return (
+        safe_float(adv.get("price") or 0.0),
+        safe_float(adv.get("minSingleTransAmount") or adv.get("minSingleTransAmountDisplay") or 0.0),
+        safe_float(adv.get("dynamicMaxSingleTransAmount") or adv.get("maxSingleTransAmount") or 0.0),
+    )
+
+
+class AdRow(NamedTuple):
+    """One search-result entry with its numeric fields parsed once."""
+    entry: dict
+    price: float
+    min_limit: float
+    max_limit: float
+
+
+def parse_ads(items):
+    """Parse a page of raw entries into AdRows, in page order, dropping malformed ones."""
+    ads = []
+    for entry in items:
+        try:
+            ads.append(AdRow(entry, *ad_numbers(entry.get("adv") or {})))
+        except Exception:
+            continue
+    return ads
+
+
+def first_match_in_page(ads, min_threshold, max_threshold, tag=""):
+    """
+    Return the first AdRow with min <= min_threshold and max >= max_threshold
+    (None/0 == no max constraint).
+    """
+    check_max = bool(max_threshold)
+    # checked once per page, not once per ad
+    debug = logging.debug if logging.getLogger().isEnabledFor(logging.DEBUG) else None
+    for ad in ads:
+        if debug:
+            debug("[first-search] %s price=%s min=%s max=%s thr_min=%s thr_max=%s", tag, ad.price, ad.min_limit, ad.max_limit, min_threshold, max_threshold)
+        if ad.min_limit <= min_threshold and (not check_max or ad.max_limit >= max_threshold):
+            return ad
+    return None
+
+
 def find_first_ad(fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold=None, rows=ROWS_PER_REQUEST):
-    for page in range(1, MAX_SCAN_PAGES + 1):
-        items = fetch_page_raw(fiat, pay_type, trade_type, page, rows=rows)
-        if not items:
-            logging.debug(f"[find_first_ad] no items returned for {fiat}/{pay_type}/{trade_type} p{page} (stopping page scan).")
-            break
-        for entry in items:
-            adv = entry.get("adv") or {}
-            try:
-                price = safe_float(adv.get("price") or 0.0)
-                min_lim = safe_float(adv.get("minSingleTransAmount") or adv.get("minSingleTransAmountDisplay") or 0.0)
-                max_lim = safe_float(adv.get("dynamicMaxSingleTransAmount") or adv.get("maxSingleTransAmount") or 0.0)
-            except Exception:
+    """
+    Fetch page 1 alone (it settles most searches), then scan the rest in batches of
+    PAGE_BATCH_SIZE fetched in parallel (paced by the global limiter). Results are
+    consumed in page order, so the first match is the same as a serial scan. A hit or an
+    empty/short page sets the scan's cancel Event, so the batch's remaining pages return
+    without sending their request, even when they are already waiting on a throttle slot.
+
+    With EARLY_EXIT_MIN_FACTOR > 0 the scan also gives up when every ad on page 1 has a
+    minimum above factor x threshold, and remembers that miss for NO_MATCH_TTL_SECONDS.
+    This trades correctness for requests: Binance orders ads by price, not by limits, so
+    a qualifying ad on a later page is missed for that long. Off by default.
+    """
+    batch_size = max(1, min(PAGE_BATCH_SIZE, MAX_SCAN_PAGES))
+    cancel = threading.Event()
+    batches = [range(1, 2)] + [range(first, min(first + batch_size, MAX_SCAN_PAGES + 1))
+                               for first in range(2, MAX_SCAN_PAGES + 1, batch_size)]
+    for pages in batches:
+        futures = [page_pool.submit(fetch_page_raw, fiat, pay_type, trade_type, page, rows=rows, cancel=cancel) for page in pages]
+        found = None
+        exhausted = False
+        for page, fut in zip(pages, futures):
+            if found or exhausted:
+                fut.cancel()
                 continue
-
-            advertiser = entry.get("advertiser") or {}
-            nick = advertiser.get("nickName") or advertiser.get("nick") or advertiser.get("userNo") or ""
-            logging.debug(
-                f"[first-search] {fiat}/{pay_type}/{trade_type} p{page} price={price} "
-                f"min={min_lim} max={max_lim} adv_by={nick} thr_min={page_limit_min_threshold} thr_max={page_limit_max_threshold}"
-            )
-
-            # check min <= min_threshold
-            min_ok = (min_lim <= page_limit_min_threshold)
-            # check max >= max_threshold, but treat 0 as "no max constraint"
-            if page_limit_max_threshold is None:
-                max_ok = True
-            else:
-                max_ok = (page_limit_max_threshold == 0) or (max_lim >= page_limit_max_threshold)
-
-            if min_ok and max_ok:
-                logging.debug(f"[first-search-match] {fiat}/{pay_type}/{trade_type} p{page} -> price={price} min={min_lim} max={max_lim} adv_by={nick}")
-                return {
-                    "trade_type": trade_type,
-                    "currency": fiat,
-                    "payment_method": pay_type,
-                    "price": price,
-                    "min_limit": min_lim,
-                    "max_limit": max_lim,
-                    "advertiser": advertiser
-                }
-        time.sleep(SLEEP_BETWEEN_PAGES)
+            items = fut.result()
+            if not items:
+                logging.debug("[find_first_ad] no items returned for %s/%s/%s p%d (stopping page scan).", fiat, pay_type, trade_type, page)
+                exhausted = True
+                cancel.set()
+                continue
+            ads = parse_ads(items)
+            match = first_match_in_page(ads, page_limit_min_threshold, page_limit_max_threshold, tag=f"{fiat}/{pay_type}/{trade_type} p{page}")
+            if match:
+                found = make_ad(match, fiat, pay_type, trade_type, f"p{page}")
+            elif page == 1 and EARLY_EXIT_MIN_FACTOR > 0 and page_limit_min_threshold > 0 and ads:
+                min_seen = min(ad.min_limit for ad in ads)
+                if min_seen > EARLY_EXIT_MIN_FACTOR * page_limit_min_threshold:
+                    logging.debug("[find_first_ad] %s/%s/%s: page 1 smallest min=%s >> thr=%s, giving up early",
+                                  fiat, pay_type, trade_type, min_seen, page_limit_min_threshold)
+                    no_match_until[(fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold)] = time.monotonic() + NO_MATCH_TTL_SECONDS
+                    exhausted = True
+            if not found and len(items) < rows:
+                logging.debug("[find_first_ad] %s/%s/%s p%d is the last page (%d<%d rows).", fiat, pay_type, trade_type, page, len(items), rows)
+                exhausted = True
+            if found or exhausted:
+                cancel.set()
+        if found or exhausted:
+            return found
     return None
 
+
+def make_ad(match, fiat, pay_type, trade_type, where=""):
+    entry, price, min_lim, max_lim = match
+    # keep only the nickname so cached ads do not pin the raw response objects
+    advertiser = entry.get("advertiser") or {}
+    nick = advertiser.get("nickName") or advertiser.get("nick") or advertiser.get("userNo") or ""
+    logging.debug("[first-search-match] %s/%s/%s %s -> price=%s min=%s max=%s adv_by=%s", fiat, pay_type, trade_type, where, price, min_lim, max_lim, nick)
+    return {
+        "trade_type": trade_type,
+        "currency": fiat,
+        "payment_method": pay_type,
+        "price": price,
+        "min_limit": min_lim,
+        "max_limit": max_lim,
+        "advertiser": nick
+    }
+
+# (fiat, pay_type, trade_type, min_thr, max_thr) -> (fingerprint, scanned_at, ad); the thresholds
+# are part of the key because the cached scan result depends on them
+side_fingerprints = {}
+# same key -> (found_at, ad); successful searches only
+ad_cache = {}
+# same key -> time until which the side is treated as having no eligible ad (early give-up verdicts)
+no_match_until = {}
+
+def page_fingerprint(items):
+    return tuple(((e.get("adv") or {}).get("advNo"), (e.get("adv") or {}).get("price")) for e in items)
+
+# same key -> Future of the search currently running for it; concurrent callers share it
+inflight_searches = {}
+inflight_searches_lock = threading.Lock()
+
+def find_first_ad_probed(fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold=None):
+    """Coalescing front for cached_side_search: identical concurrent searches issue one request tree."""
+    key = (fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold)
+    return run_coalesced(inflight_searches, inflight_searches_lock, key, cached_side_search, *key)
+
+def cached_side_search(fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold):
+    """
+    Return a side's first qualifying ad, reusing a result younger than the currency's
+    AD_CACHE_TTLS entry (or a recent early give-up) without any request; otherwise
+    search via search_side.
+    """
+    cache_key = (fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold)
+    cached_ad = ad_cache.get(cache_key)
+    if cached_ad and (time.monotonic() - cached_ad[0]) < ad_cache_ttls.get(fiat, DEFAULT_AD_CACHE_TTL):
+        return cached_ad[1]
+    if no_match_until.get(cache_key, 0.0) > time.monotonic():
+        return None
+    ad = search_side(fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold)
+    if ad:
+        ad_cache[cache_key] = (time.monotonic(), ad)
+    return ad
+
+def search_side(fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold):
+    """
+    Probe the top PROBE_ROWS ads first. A match there is the first match overall, and
+    a short probe means the book holds no match at all; otherwise reuse the last
+    full-scan result while the top-of-book fingerprint is unchanged and younger than
+    FINGERPRINT_TTL_SECONDS, else run find_first_ad.
+    """
+    key = (fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold)
+    items = fetch_page_raw(fiat, pay_type, trade_type, 1, rows=PROBE_ROWS)
+    if not items:
+        side_fingerprints.pop(key, None)
+        return None
+    match = first_match_in_page(parse_ads(items), page_limit_min_threshold, page_limit_max_threshold, tag=f"{fiat}/{pay_type}/{trade_type} probe")
+    if match:
+        side_fingerprints.pop(key, None)
+        return make_ad(match, fiat, pay_type, trade_type, "probe")
+
+    if len(items) < PROBE_ROWS:
+        # the probe already holds the whole book
+        side_fingerprints.pop(key, None)
+        return None
+
+    fp = page_fingerprint(items)
+    now = time.monotonic()
+    cached = side_fingerprints.get(key)
+    if cached and cached[0] == fp and (now - cached[1]) < FINGERPRINT_TTL_SECONDS:
+        logging.debug("[probe] %s/%s/%s top-of-book unchanged — reusing last scan", fiat, pay_type, trade_type)
+        return cached[2]
+
+    ad = find_first_ad(fiat, pay_type, trade_type, page_limit_min_threshold, page_limit_max_threshold)
+    side_fingerprints[key] = (fp, now, ad)
+    return ad
+
 # ---------------------- messaging ----------------------
 
+currency_flags = {"EGP":"🇪🇬","GBP":"🇬🇧","EUR":"🇪🇺","USD":"🇺🇸","CAD":"🇨🇦","NZD":"🇳🇿","AUD":"🇦🇺","JPY":"🇯🇵","MAD":"🇲🇦","SAR":"🇸🇦","AED":"🇦🇪","KWD":"🇰🇼","DZD":"🇩🇿"}
+
+
 def format_currency_flag(cur):
-    flags = {"EGP":"🇪🇬","GBP":"🇬🇧","EUR":"🇪🇺","USD":"🇺🇸","CAD":"🇨🇦","NZD":"🇳🇿","AUD":"🇦🇺","JPY":"🇯🇵","MAD":"🇲🇦","SAR":"🇸🇦","AED":"🇦🇪","KWD":"🇰🇼","DZD":"🇩🇿"}
-    return flags.get(cur, "")
+    return currency_flags.get(cur, "")
+
+
+TELEGRAM_SENDPHOTO_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
+TELEGRAM_SENDMESSAGE_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+TELEGRAM_SENDMEDIAGROUP_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMediaGroup"
+TELEGRAM_CAPTION_MAX = 1024
+# file_ids are per bot; the cache file stores "<bot id>\t<file_id>" (the bot id is the public part of the token)
+TELEGRAM_BOT_ID = TELEGRAM_BOT_TOKEN.split(":", 1)[0]
+
+
+def load_cached_file_id():
+    try:
+        with open(TELEGRAM_FILE_ID_CACHE, encoding="utf-8") as f:
+            bot_id, file_id = f.read().strip().split("\t", 1)
+    except (OSError, ValueError):
+        return ""
+    return file_id if bot_id == TELEGRAM_BOT_ID else ""
+
+
+def remember_file_id(jr):
+    """Reuse the file_id of a successful URL/upload sendPhoto for all later alerts."""
+    global TELEGRAM_IMAGE_FILE_ID
+    try:
+        file_id = jr["result"]["photo"][-1]["file_id"]
+    except (KeyError, IndexError, TypeError):
+        return
+    if not file_id or file_id == TELEGRAM_IMAGE_FILE_ID:
+        return
+    TELEGRAM_IMAGE_FILE_ID = file_id
+    cache_dir = os.path.dirname(TELEGRAM_FILE_ID_CACHE) or "."
+    tmp_path = None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # a unique temp file per write: concurrent alert threads never share one
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=os.path.basename(TELEGRAM_FILE_ID_CACHE) + ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{TELEGRAM_BOT_ID}\t{file_id}")
+        os.replace(tmp_path, TELEGRAM_FILE_ID_CACHE)  # atomic: readers never see a partial file
+    except OSError as e:
+        logging.debug(f"Could not persist Telegram file_id: {e}")
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+if not TELEGRAM_IMAGE_FILE_ID:
+    TELEGRAM_IMAGE_FILE_ID = load_cached_file_id()
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def _caption(message):
+    return message if len(message) <= TELEGRAM_CAPTION_MAX else message[:TELEGRAM_CAPTION_MAX - 4] + "..."
 
 
 def _try_send_photo(payload_data, files=None):
-    sendphoto_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendPhoto"
     try:
         if files is not None:
-            r = session.post(sendphoto_url, data=payload_data, files=files, timeout=TIMEOUT)
+            r = tg_session.post(TELEGRAM_SENDPHOTO_URL, data=payload_data, files=files, timeout=TIMEOUT)
         else:
-            r = session.post(sendphoto_url, data=payload_data, timeout=TIMEOUT)
+            r = tg_session.post(TELEGRAM_SENDPHOTO_URL, data=payload_data, timeout=TIMEOUT)
         try:
-            jr = r.json()
+            jr = json_loads(r.content)
         except Exception:
             jr = None
         if r.ok and jr and jr.get("ok"):
@@ -428,9 +968,10 @@ def send_telegram_alert(message):
         return False
 
     max_photo_attempts = 3
+    caption = _caption(message)
 
     if TELEGRAM_IMAGE_FILE_ID:
-        payload = {"chat_id": TELEGRAM_CHAT_ID, "photo": TELEGRAM_IMAGE_FILE_ID, "caption": (message if len(message) <= 1024 else (message[:1020] + "...")), "parse_mode": "HTML"}
+        payload = {"chat_id": TELEGRAM_CHAT_ID, "photo": TELEGRAM_IMAGE_FILE_ID, "caption": caption, "parse_mode": "HTML"}
         for attempt in range(1, max_photo_attempts + 1):
             ok, jr_or_text, status = _try_send_photo(payload)
             if ok:
@@ -440,25 +981,27 @@ def send_telegram_alert(message):
             time.sleep(0.5 * attempt + random.uniform(0, 0.3))
 
     if TELEGRAM_IMAGE_URL:
-        payload = {"chat_id": TELEGRAM_CHAT_ID, "photo": TELEGRAM_IMAGE_URL, "caption": (message if len(message) <= 1024 else (message[:1020] + "...")), "parse_mode": "HTML"}
+        payload = {"chat_id": TELEGRAM_CHAT_ID, "photo": TELEGRAM_IMAGE_URL, "caption": caption, "parse_mode": "HTML"}
         for attempt in range(1, max_photo_attempts + 1):
             ok, jr_or_text, status = _try_send_photo(payload)
             if ok:
                 logging.info("Telegram photo alert sent (via URL).")
+                remember_file_id(jr_or_text)
                 return True
             logging.warning(f"sendPhoto(via URL) attempt {attempt}/{max_photo_attempts} failed status={status} resp={jr_or_text}")
             time.sleep(0.5 * attempt + random.uniform(0, 0.3))
 
         try:
-            img_resp = session.get(TELEGRAM_IMAGE_URL, timeout=10)
+            img_resp = tg_session.get(TELEGRAM_IMAGE_URL, timeout=10)
             img_resp.raise_for_status()
             content_type = img_resp.headers.get("content-type", "image/png")
             files = {"photo": ("zoozfx.png", img_resp.content, content_type)}
-            data = {"chat_id": TELEGRAM_CHAT_ID, "caption": (message if len(message) <= 1024 else (message[:1020] + "...")), "parse_mode": "HTML"}
+            data = {"chat_id": TELEGRAM_CHAT_ID, "caption": caption, "parse_mode": "HTML"}
             for attempt in range(1, max_photo_attempts + 1):
                 ok, jr_or_text, status = _try_send_photo(data, files=files)
                 if ok:
                     logging.info("Telegram photo alert sent (uploaded file).")
+                    remember_file_id(jr_or_text)
                     return True
                 logging.warning(f"sendPhoto(upload) attempt {attempt}/{max_photo_attempts} failed status={status} resp={jr_or_text}")
                 time.sleep(0.5 * attempt + random.uniform(0, 0.3))
@@ -466,11 +1009,10 @@ def send_telegram_alert(message):
             logging.warning(f"sendPhoto(upload) exception: {e}")
 
     try:
-        sendmsg_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         payload2 = {"chat_id": TELEGRAM_CHAT_ID, "text": message, "parse_mode": "HTML", "disable_web_page_preview": True}
-        r3 = session.post(sendmsg_url, json=payload2, timeout=TIMEOUT)
+        r3 = tg_session.post(TELEGRAM_SENDMESSAGE_URL, data=json_dumps(payload2), headers=JSON_HEADERS, timeout=TIMEOUT)
         try:
-            jr3 = r3.json()
+            jr3 = json_loads(r3.content)
         except Exception:
             jr3 = None
         if r3.ok:
@@ -483,10 +1025,71 @@ def send_telegram_alert(message):
         logging.error(f"Failed to send Telegram message: {e}")
         return False
 
+def send_media_group(messages):
+    """Send 2..10 captioned copies of the alert image as one album. Returns True on success."""
+    photo = TELEGRAM_IMAGE_FILE_ID or TELEGRAM_IMAGE_URL
+    if not photo or not (2 <= len(messages) <= TELEGRAM_MEDIA_GROUP_MAX):
+        return False
+    media = [
+        {"type": "photo", "media": photo, "caption": _caption(m), "parse_mode": "HTML"}
+        for m in messages
+    ]
+    try:
+        r = tg_session.post(TELEGRAM_SENDMEDIAGROUP_URL, data={"chat_id": TELEGRAM_CHAT_ID, "media": json_dumps(media)}, timeout=TIMEOUT)
+        try:
+            jr = json_loads(r.content)
+        except Exception:
+            jr = None
+        if r.ok and jr and jr.get("ok"):
+            logging.info(f"Telegram media group sent ({len(messages)} alerts).")
+            return True
+        logging.warning(f"sendMediaGroup failed status={r.status_code} resp={jr or getattr(r, 'text', '')}")
+    except Exception as e:
+        logging.warning(f"sendMediaGroup exception: {e}")
+    return False
+
+# ---------------------- alert queue ----------------------
+# alerts produced during a cycle: (pair_key, kind, message, spread, state_kwargs).
+# state_kwargs is applied via set_active_state_snapshot only once the alert is delivered.
+alert_queue = []
+alert_queue_lock = threading.Lock()
+
+def dispatch_alert(pair_key, kind, message, spread_percent, **state_kwargs):
+    item = (pair_key, kind, message, spread_percent, state_kwargs)
+    if TELEGRAM_BATCH_ALERTS == "1":
+        with alert_queue_lock:
+            alert_queue.append(item)
+    else:
+        deliver_alerts([item])
+
+def flush_alerts():
+    with alert_queue_lock:
+        batch = alert_queue[:]
+        alert_queue.clear()
+    for i in range(0, len(batch), TELEGRAM_MEDIA_GROUP_MAX):
+        deliver_alerts(batch[i:i + TELEGRAM_MEDIA_GROUP_MAX])
+
+def deliver_alerts(items):
+    if TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID and len(items) > 1 and send_media_group([it[2] for it in items]):
+        results = [True] * len(items)
+    else:
+        # single alert, batching unavailable or the album failed: fall back to one send each
+        results = [send_telegram_alert(it[2]) for it in items]
+    for (pair_key, kind, _, spread_percent, state_kwargs), sent in zip(items, results):
+        if sent:
+            logging.info(f"{kind.capitalize()} alert sent for {pair_key} (spread {spread_percent:.2f}%)")
+            set_active_state_snapshot(pair_key, mark_sent=True, last_message_type=kind, **state_kwargs)
+        else:
+            logging.warning(f"Failed to send {kind} alert for {pair_key}")
+
 # ---------------------- message builders ----------------------
 ZOOZ_LINK = 'https://zoozfx.com'
 ZOOZ_HTML = f'©️<a href="{ZOOZ_LINK}">ZoozFX</a>'
 
+HASHTAG_STRIP_RE = re.compile(r'[^0-9A-Za-z]+')
+
+
+@lru_cache(maxsize=512)
 def _make_hashtag(cur, method):
     if not cur:
         cur_token = ""
@@ -495,7 +1098,7 @@ def _make_hashtag(cur, method):
     method_label = friendly_pay_names.get(method, method) if method else method
     if not method_label:
         method_label = ""
-    token = re.sub(r'[^0-9A-Za-z]+', '_', str(method_label).strip()).strip('_')
+    token = HASHTAG_STRIP_RE.sub('_', str(method_label).strip()).strip('_')
     if len(token) > 30:
         token = token[:30].rstrip('_')
     if not cur_token or not token:
@@ -503,221 +1106,244 @@ def _make_hashtag(cur, method):
     return f"#{cur_token}_{token}"
 
 
-def build_alert_message(cur, pay_friendly, seller_ad, buyer_ad, spread_percent):
-    flag = format_currency_flag(cur)
-    abs_diff = abs(buyer_ad["price"] - seller_ad["price"])
-    sign = "+" if spread_percent > 0 else ""
-    method_name = (seller_ad.get("payment_method") or buyer_ad.get("payment_method") or pay_friendly)
-    hashtag = _make_hashtag(cur, method_name)
-    hashtag_line = (hashtag) if hashtag else ""
-    
-    seller_price = buyer_ad['price']
-    buyer_price = seller_ad['price']
-    fee_factor = 1.0 if cur == "EGP" else 0.9855
-    profit_value = ((100*fee_factor*seller_price)/buyer_price)-100
-    sign = "+" if spread_percent >= 0 else ""
-    
+def _message_template(header, spread_icon):
+    """
+    Pre-built template for one message kind: {flag}/{hashtag}/{cur} are filled once per pair
+    by _pair_template, leaving %-placeholders for the per-alert numbers.
+    """
     return (
-        f"🚨 Alert {flag} ★ {hashtag_line} ★\n\n"
-        f"🔴 Sell: <code>{buyer_ad['price']:.4f} {cur}</code>\n"
-        f"🟢 Buy: <code>{seller_ad['price']:.4f} {cur}</code>\n\n"
-        f"🔥 <b>Spread: {sign}{spread_percent:.2f}%  (<code>{abs_diff:.4f} {cur}</code>)</b>\n\n"
-        f"💰 Profit: <code>{profit_value:.4f}%</code>\n\n"
-        f"➤ {ZOOZ_HTML} ⭐️"
+        header + " {flag} ★ {hashtag} ★\n\n"
+        "🔴 Sell: <code>%.4f {cur}</code>\n"
+        "🟢 Buy: <code>%.4f {cur}</code>\n\n"
+        + spread_icon + " <b>Spread: %s%.2f%%  (<code>%.4f {cur}</code>)</b>\n\n"
+        "💰 Profit: <code>%.4f%%</code>\n\n"
+        "➤ " + ZOOZ_HTML.replace("%", "%%") + " ⭐️"
     )
 
+ALERT_TEMPLATE = _message_template("🚨 Alert", "🔥")
+UPDATE_TEMPLATE = _message_template("🔁 Update", "🔥")
+END_TEMPLATE = _message_template("❌ Ended", "❌")
 
-def build_update_message(cur, pay_friendly, seller_ad, buyer_ad, spread_percent):
-    flag = format_currency_flag(cur)
-    abs_diff = abs(buyer_ad["price"] - seller_ad["price"])
-    sign = "+" if spread_percent > 0 else ""
+
+# 100 x the fee factor on the sell leg (EGP pairs carry no fee), folded once
+PROFIT_SELL_SCALE = 100 * 0.9855
+
+
+@lru_cache(maxsize=512)
+def _pair_template(template, cur, method_name):
+    def esc(v):
+        return v.replace("%", "%%")
+    return template.format(flag=esc(format_currency_flag(cur)), hashtag=esc(_make_hashtag(cur, method_name)), cur=esc(str(cur)))
+
+
+def _build_message(template, cur, pay_friendly, seller_ad, buyer_ad, spread_percent):
+    sell_price = buyer_ad['price']
+    buy_price = seller_ad['price']
     method_name = (seller_ad.get("payment_method") or buyer_ad.get("payment_method") or pay_friendly)
-    hashtag = _make_hashtag(cur, method_name)
-    hashtag_line = (hashtag) if hashtag else ""
-
-    seller_price = buyer_ad['price']
-    buyer_price = seller_ad['price']
-    fee_factor = 1.0 if cur == "EGP" else 0.9855
-    profit_value = ((100*fee_factor*seller_price)/buyer_price)-100
-    sign = "+" if spread_percent >= 0 else ""
-    
-    return (
-        f"🔁 Update {flag} ★ {hashtag_line} ★\n\n"
-        f"🔴 Sell: <code>{buyer_ad['price']:.4f} {cur}</code>\n"
-        f"🟢 Buy: <code>{seller_ad['price']:.4f} {cur}</code>\n\n"
-        f"🔥 <b>Spread: {sign}{spread_percent:.2f}%  (<code>{abs_diff:.4f} {cur}</code>)</b>\n\n"
-        f"💰 Profit: <code>{profit_value:.4f}%</code>\n\n"
-        f"➤ {ZOOZ_HTML} ⭐️"
+    profit_value = (((100.0 if cur == "EGP" else PROFIT_SELL_SCALE) * sell_price) / buy_price) - 100
+    return _pair_template(template, cur, method_name) % (
+        sell_price, buy_price,
+        "+" if spread_percent >= 0 else "", spread_percent, abs(sell_price - buy_price),
+        profit_value,
     )
 
 
+def build_alert_message(cur, pay_friendly, seller_ad, buyer_ad, spread_percent):
+    return _build_message(ALERT_TEMPLATE, cur, pay_friendly, seller_ad, buyer_ad, spread_percent)
+
+
+def build_update_message(cur, pay_friendly, seller_ad, buyer_ad, spread_percent):
+    return _build_message(UPDATE_TEMPLATE, cur, pay_friendly, seller_ad, buyer_ad, spread_percent)
+
+
 def build_end_message(cur, pay_friendly, seller_ad, buyer_ad, spread_percent):
-    flag = format_currency_flag(cur)
-    abs_diff = abs(buyer_ad["price"] - seller_ad["price"])
-    sign = "+" if spread_percent > 0 else ""
-    method_name = (seller_ad.get("payment_method") or buyer_ad.get("payment_method") or pay_friendly)
-    hashtag = _make_hashtag(cur, method_name)
-    hashtag_line = (hashtag) if hashtag else ""
-
-    seller_price = buyer_ad['price']
-    buyer_price = seller_ad['price']
-    fee_factor = 1.0 if cur == "EGP" else 0.9855
-    profit_value = ((100*fee_factor*seller_price)/buyer_price)-100
-    sign = "+" if spread_percent >= 0 else ""
-    
-    return (
-        f"❌ Ended {flag} ★ {hashtag_line} ★\n\n"
-        f"🔴 Sell: <code>{buyer_ad['price']:.4f} {cur}</code>\n"
-        f"🟢 Buy: <code>{seller_ad['price']:.4f} {cur}</code>\n\n"
-        f"❌ <b>Spread: {sign}{spread_percent:.2f}%  (<code>{abs_diff:.4f} {cur}</code>)</b>\n\n"
-        f"💰 Profit: <code>{profit_value:.4f}%</code>\n\n"
-        f"➤ {ZOOZ_HTML} ⭐️"
-    )
+    return _build_message(END_TEMPLATE, cur, pay_friendly, seller_ad, buyer_ad, spread_percent)
 
 # ---------------------- state & locks ----------------------
+@dataclass(frozen=True, slots=True)
+class PairState:
+    """Immutable per-pair alert state; replaced wholesale on every update."""
+    active: bool = False
+    last_spread: Optional[float] = None
+    last_buy_price: Optional[float] = None
+    last_sell_price: Optional[float] = None
+    last_buy_at: Optional[float] = None  # when last_buy_price was last fetched
+    since: Optional[float] = None
+    last_sent_spread: Optional[float] = None
+    last_sent_buy: Optional[float] = None
+    last_sent_sell: Optional[float] = None
+    last_sent_time: Optional[float] = None
+    last_message_type: Optional[str] = None
+    last_sent_signature: Optional[tuple] = None
+
+
+EMPTY_PAIR_STATE = PairState()
+
+# State is swapped per key with a single dict store (atomic under the GIL), so reads and
+# writes take no global lock. Writers for a given key are serialized by its pair lock.
 active_states = {}
-active_states_lock = threading.Lock()
 pair_locks = {}
 
+# (currency, method) -> True while the last processed spread was at or above the pair's threshold
+pair_live = {}
+# EWMA of process_pair wall time per (currency, method), seconds
+pair_latency = {}
+# (currency, method) -> time.monotonic() at which its latest check started
+pair_checked_at = {}
+
+def schedule_key(spec):
+    """
+    Live pairs first; within each group slowest first (longest-processing-time order),
+    so the long pairs overlap the short ones and a batch ends close to its slowest pair.
+    """
+    key = (spec.currency, spec.method)
+    return (not pair_live.get(key, False), -pair_latency.get(key, 1.0))
+
 def get_pair_lock(pair_key):
-    with active_states_lock:
-        lock = pair_locks.get(pair_key)
-        if lock is None:
-            lock = threading.Lock()
-            pair_locks[pair_key] = lock
-        return lock
+    lock = pair_locks.get(pair_key)
+    if lock is None:
+        # setdefault is atomic: racing creators all get the same lock back
+        lock = pair_locks.setdefault(pair_key, threading.Lock())
+    return lock
 
 def get_active_state(pair_key):
-    with active_states_lock:
-        rec = active_states.get(pair_key)
-        if not rec:
-            return {
-                "active": False,
-                "last_spread": None,
-                "last_buy_price": None,
-                "last_sell_price": None,
-                "since": None,
-                "last_sent_spread": None,
-                "last_sent_buy": None,
-                "last_sent_sell": None,
-                "last_sent_time": None,
-                "last_message_type": None,
-                "last_sent_signature": None
-            }
-        return rec.copy()
-
-def set_active_state_snapshot(pair_key, *, active=None, last_spread=None, last_buy_price=None, last_sell_price=None, mark_sent=False, last_sent_signature=None, last_message_type=None):
-    with active_states_lock:
-        rec = active_states.get(pair_key) or {
-            "active": False,
-            "last_spread": None,
-            "last_buy_price": None,
-            "last_sell_price": None,
-            "since": None,
-            "last_sent_spread": None,
-            "last_sent_buy": None,
-            "last_sent_sell": None,
-            "last_sent_time": None,
-            "last_message_type": None,
-            "last_sent_signature": None
-        }
-        if active is not None:
-            rec["active"] = bool(active)
-            rec["since"] = time.time() if active else None
+    # PairState is immutable, so the stored reference is a consistent snapshot
+    return active_states.get(pair_key, EMPTY_PAIR_STATE)
+
+def _as_float(val):
+    try:
+        return float(val)
+    except Exception:
+        return val
+
+def set_active_state_snapshot(pair_key, *, active=None, last_spread=None, last_buy_price=None, last_sell_price=None, mark_sent=False, last_sent_signature=None, last_message_type=None, now=None):
+    """Publish an updated PairState; timestamps are time.monotonic() (`now` lets callers reuse one reading)."""
+    if now is None:
+        now = time.monotonic()
+    changes = {}
+    if active is not None:
+        changes["active"] = bool(active)
+        changes["since"] = now if active else None
+    if last_spread is not None:
+        changes["last_spread"] = _as_float(last_spread)
+    if last_buy_price is not None:
+        changes["last_buy_price"] = _as_float(last_buy_price)
+        changes["last_buy_at"] = now
+    if last_sell_price is not None:
+        changes["last_sell_price"] = _as_float(last_sell_price)
+    if mark_sent:
         if last_spread is not None:
-            try:
-                rec["last_spread"] = float(last_spread)
-            except Exception:
-                rec["last_spread"] = last_spread
+            changes["last_sent_spread"] = float(last_spread)
         if last_buy_price is not None:
-            try:
-                rec["last_buy_price"] = float(last_buy_price)
-            except Exception:
-                rec["last_buy_price"] = last_buy_price
+            changes["last_sent_buy"] = float(last_buy_price)
         if last_sell_price is not None:
-            try:
-                rec["last_sell_price"] = float(last_sell_price)
-            except Exception:
-                rec["last_sell_price"] = last_sell_price
-        if mark_sent:
-            rec["last_sent_spread"] = float(last_spread) if last_spread is not None else rec.get("last_sent_spread")
-            rec["last_sent_buy"] = float(last_buy_price) if last_buy_price is not None else rec.get("last_sent_buy")
-            rec["last_sent_sell"] = float(last_sell_price) if last_sell_price is not None else rec.get("last_sent_sell")
-            rec["last_sent_time"] = time.time()
-            if last_message_type is not None:
-                rec["last_message_type"] = last_message_type
-            if last_sent_signature is not None:
-                rec["last_sent_signature"] = last_sent_signature
-        active_states[pair_key] = rec
+            changes["last_sent_sell"] = float(last_sell_price)
+        changes["last_sent_time"] = now
+        if last_message_type is not None:
+            changes["last_message_type"] = last_message_type
+        if last_sent_signature is not None:
+            changes["last_sent_signature"] = last_sent_signature
+    active_states[pair_key] = replace(active_states.get(pair_key, EMPTY_PAIR_STATE), **changes)
+
+last_prune_ts = [0.0]
+
+def prune_state(now=None):
+    """
+    Drop expired search-cache entries and long-idle pair states so the maps stay
+    bounded on long runs. Runs from the loop thread between batches, at most
+    once per STATE_PRUNE_EVERY seconds.
+    """
+    now = time.monotonic() if now is None else now
+    if now - last_prune_ts[0] < STATE_PRUNE_EVERY:
+        return
+    last_prune_ts[0] = now
+    dropped = 0
+    for key, (fetched_at, _) in list(page_cache.items()):
+        if now - fetched_at >= PAGE_CACHE_TTL:
+            dropped += page_cache.pop(key, None) is not None
+    for key, (found_at, _) in list(ad_cache.items()):
+        if now - found_at >= ad_cache_ttls.get(key[0], DEFAULT_AD_CACHE_TTL):
+            dropped += ad_cache.pop(key, None) is not None
+    for key, until in list(no_match_until.items()):
+        if until <= now:
+            dropped += no_match_until.pop(key, None) is not None
+    for key, (_, scanned_at, _) in list(side_fingerprints.items()):
+        if now - scanned_at >= FINGERPRINT_TTL_SECONDS:
+            dropped += side_fingerprints.pop(key, None) is not None
+    state_ttl = max(STATE_TTL_SECONDS, ALERT_TTL_SECONDS)
+    for key, st in list(active_states.items()):
+        if not st.active and st.last_sent_time is not None and now - st.last_sent_time >= state_ttl:
+            dropped += active_states.pop(key, None) is not None
+    if dropped:
+        logging.debug(f"Pruned {dropped} expired cache/state entries")
 
 # ---------------------- update logic ----------------------
 
-def relative_change_percent(old, new):
-    try:
-        if old is None or old == 0:
-            return float("inf")
-        return abs((new - old) / old) * 100.0
-    except Exception:
-        return float("inf")
+def spread_pct(sell_price, buy_price):
+    """Spread in percent between the price you can sell at (BUY page) and buy at (SELL page)."""
+    return ((sell_price / buy_price) - 1.0) * 100.0
 
-def compute_signature(spread, buy, sell, tol=ALERT_VALUE_TOLERANCE):
-    if tol <= 0:
-        tol = 1e-8
-    try:
-        s_bin = int(round(spread / tol))
-    except Exception:
-        s_bin = None
+def price_moved(old, new):
+    """True if new differs from old by at least ALERT_UPDATE_PRICE_CHANGE_PERCENT (division-free)."""
+    return not old or abs(new - old) * 100.0 >= ALERT_UPDATE_PRICE_CHANGE_PERCENT * abs(old)
+
+# signatures bin by multiplying with 1/tol, computed once (tol <= 0 falls back to 1e-8)
+ALERT_SIG_SCALE = 1.0 / (ALERT_VALUE_TOLERANCE if ALERT_VALUE_TOLERANCE > 0 else 1e-8)
+
+def _sig_bin(value, scale):
     try:
-        b_bin = int(round(buy / tol))
+        return int(round(value * scale))
     except Exception:
-        b_bin = None
+        return None
+
+def compute_signature(spread, buy, sell, scale=ALERT_SIG_SCALE):
     try:
-        sel_bin = int(round(sell / tol))
+        # round() of a float already returns an int
+        return (round(spread * scale), round(buy * scale), round(sell * scale))
     except Exception:
-        sel_bin = None
-    return (s_bin, b_bin, sel_bin)
+        # NaN/inf/non-numeric: bin each field separately, None for the bad ones
+        return (_sig_bin(spread, scale), _sig_bin(buy, scale), _sig_bin(sell, scale))
 
 def should_send_update(pair_state, new_spread, new_buy, new_sell, signature=None):
-    last_sent_spread = pair_state.get("last_sent_spread")
-    last_sent_buy = pair_state.get("last_sent_buy")
-    last_sent_sell = pair_state.get("last_sent_sell")
-
-    if ALERT_DEDUP_MODE == 'exact' and signature is not None:
-        last_sig = pair_state.get('last_sent_signature')
-        if last_sig is not None and last_sig == signature:
-            logging.debug(f"Dedup: signature match -> suppressing send (sig={signature})")
-            return False
+    if EXACT_DEDUP and signature is not None and signature == pair_state.last_sent_signature:
+        logging.debug("Dedup: signature match -> suppressing send (sig=%s)", signature)
+        return False
 
+    last_sent_spread = pair_state.last_sent_spread
+    last_sent_buy = pair_state.last_sent_buy
+    last_sent_sell = pair_state.last_sent_sell
     if last_sent_spread is None and last_sent_buy is None and last_sent_sell is None:
         return True
 
-    if ALERT_UPDATE_ON_ANY_CHANGE == "1":
-        spread_changed = not values_close(last_sent_spread, new_spread)
-        buy_changed = not values_close(last_sent_buy, new_buy)
-        sell_changed = not values_close(last_sent_sell, new_sell)
-        return spread_changed or buy_changed or sell_changed
+    if UPDATE_ON_ANY_CHANGE:
+        return not (values_close(last_sent_spread, new_spread)
+                    and values_close(last_sent_buy, new_buy)
+                    and values_close(last_sent_sell, new_sell))
 
-    if last_sent_spread is None:
-        spread_diff = abs(new_spread)
-    else:
-        spread_diff = abs(new_spread - last_sent_spread)
+    spread_diff = abs(new_spread) if last_sent_spread is None else abs(new_spread - last_sent_spread)
     if spread_diff >= ALERT_UPDATE_MIN_DELTA_PERCENT:
         return True
+    return ((last_sent_buy is not None and price_moved(last_sent_buy, new_buy))
+            or (last_sent_sell is not None and price_moved(last_sent_sell, new_sell)))
 
-    if last_sent_buy is not None and relative_change_percent(last_sent_buy, new_buy) >= ALERT_UPDATE_PRICE_CHANGE_PERCENT:
-        return True
-    if last_sent_sell is not None and relative_change_percent(last_sent_sell, new_sell) >= ALERT_UPDATE_PRICE_CHANGE_PERCENT:
-        return True
-
-    return False
-
-def can_send_start(pair_state):
-    last_sent_time = pair_state.get("last_sent_time")
+def can_send_start(pair_state, now=None):
+    last_sent_time = pair_state.last_sent_time
     if last_sent_time is None or ALERT_TTL_SECONDS <= 0:
         return True
-    return (time.time() - last_sent_time) >= ALERT_TTL_SECONDS
+    return ((time.monotonic() if now is None else now) - last_sent_time) >= ALERT_TTL_SECONDS
 
 # ---------------------- core processing (FIRST-ad logic + fast-probe) ----------------------
+# per-pair tasks of the monitor loop; persistent so threads are not respawned every batch
+pair_pool = ThreadPoolExecutor(max_workers=max(1, MAX_CONCURRENT_WORKERS), thread_name_prefix="pair")
+
+# persistent pool for the BUY/SELL halves of a pair (two per pair worker). The pools are
+# split so no task ever waits on its own pool: pair tasks wait on side_pool, side tasks
+# wait on page_pool but never submit to side_pool, and page tasks submit nothing.
+side_pool = ThreadPoolExecutor(max_workers=2 * max(1, MAX_CONCURRENT_WORKERS), thread_name_prefix="side")
+
+# page fetches for find_first_ad
+page_pool = ThreadPoolExecutor(max_workers=2 * max(1, MAX_CONCURRENT_WORKERS) * max(1, min(PAGE_BATCH_SIZE, MAX_SCAN_PAGES)), thread_name_prefix="page")
+
 paytype_variants_map = {
     "SkrillMoneybookers": ["SkrillMoneybookers","Skrill","Skrill (Moneybookers)"],
     "NETELLER": ["NETELLER"],
@@ -729,9 +1355,13 @@ def fast_probe_ads(currency, variant, min_threshold, max_threshold):
     """
     Cheap probe: fetch top (page=1, rows=FAST_PROBE_ROWS) for BUY and SELL.
     Now checks both min and max thresholds (max_threshold==0 means ignore max).
+    When both top ads pass the limits they are the first matches a full scan would
+    find, so they are returned whatever the spread; process_pair judges the threshold.
     """
-    buy_items = fetch_page_raw(currency, variant, "BUY", 1, rows=FAST_PROBE_ROWS)
-    sell_items = fetch_page_raw(currency, variant, "SELL", 1, rows=FAST_PROBE_ROWS)
+    fut_b = side_pool.submit(fetch_page_raw, currency, variant, "BUY", 1, rows=FAST_PROBE_ROWS)
+    fut_s = side_pool.submit(fetch_page_raw, currency, variant, "SELL", 1, rows=FAST_PROBE_ROWS)
+    buy_items = fut_b.result()
+    sell_items = fut_s.result()
 
     if not buy_items or not sell_items:
         return None, None
@@ -740,128 +1370,200 @@ def fast_probe_ads(currency, variant, min_threshold, max_threshold):
     s = sell_items[0]
     adv_b = b.get("adv") or {}
     adv_s = s.get("adv") or {}
-    buyer_price = safe_float(adv_b.get("price") or 0.0)
-    buyer_min = safe_float(adv_b.get("minSingleTransAmount") or adv_b.get("minSingleTransAmountDisplay") or 0.0)
-    buyer_max = safe_float(adv_b.get("dynamicMaxSingleTransAmount") or adv_b.get("maxSingleTransAmount") or 0.0)
-    seller_price = safe_float(adv_s.get("price") or 0.0)
-    seller_min = safe_float(adv_s.get("minSingleTransAmount") or adv_s.get("minSingleTransAmountDisplay") or 0.0)
-    seller_max = safe_float(adv_s.get("dynamicMaxSingleTransAmount") or adv_s.get("maxSingleTransAmount") or 0.0)
+    buyer_price, buyer_min, buyer_max = ad_numbers(adv_b)
+    seller_price, seller_min, seller_max = ad_numbers(adv_s)
 
     min_ok = (buyer_min <= min_threshold and seller_min <= min_threshold)
     # treat max_threshold==0 as "no max constraint"
     max_ok = (max_threshold == 0) or (buyer_max >= max_threshold and seller_max >= max_threshold)
 
     if min_ok and max_ok and seller_price > 0:
-        spread_percent = ((buyer_price / seller_price) - 1.0) * 100.0
-        if spread_percent >= PROFIT_THRESHOLD_PERCENT:
-            buyer_ad = {"trade_type":"BUY","currency":currency,"payment_method":variant,"price":buyer_price,"min_limit":buyer_min,"max_limit":buyer_max,"advertiser":b.get("advertiser")}
-            seller_ad = {"trade_type":"SELL","currency":currency,"payment_method":variant,"price":seller_price,"min_limit":seller_min,"max_limit":seller_max,"advertiser":s.get("advertiser")}
-            return buyer_ad, seller_ad
+        return (make_ad((b, buyer_price, buyer_min, buyer_max), currency, variant, "BUY", "fast-probe"),
+                make_ad((s, seller_price, seller_min, seller_max), currency, variant, "SELL", "fast-probe"))
     return None, None
 
-def process_pair(currency, method, min_threshold, max_threshold):
-    variants = paytype_variants_map.get(method, [method])
-    for variant in variants:
-        pair_key = f"{currency}|{variant}"
-        lock = get_pair_lock(pair_key)
-        with lock:
-            buyer_ad = None
-            seller_ad = None
-            try:
-                buyer_ad, seller_ad = fast_probe_ads(currency, variant, min_threshold, max_threshold)
-            except Exception as e:
-                logging.debug(f"fast_probe failed for {pair_key}: {e}")
-
-            if not buyer_ad or not seller_ad:
-                with ThreadPoolExecutor(max_workers=2) as ex:
-                    fut_b = ex.submit(find_first_ad, currency, variant, "BUY", min_threshold, max_threshold)
-                    fut_s = ex.submit(find_first_ad, currency, variant, "SELL", min_threshold, max_threshold)
-                    try:
-                        buyer_ad = fut_b.result()
-                    except Exception as e:
-                        logging.debug(f"buyer fetch error for {pair_key}: {e}")
-                        buyer_ad = None
-                    try:
-                        seller_ad = fut_s.result()
-                    except Exception as e:
-                        logging.debug(f"seller fetch error for {pair_key}: {e}")
-                        seller_ad = None
-
-            logging.debug(f"[found] {pair_key} buyer_ad={buyer_ad} seller_ad={seller_ad}")
-
-            if not buyer_ad or not seller_ad:
-                logging.debug(f"{pair_key}: missing buyer or seller ad (buyer_found={bool(buyer_ad)} seller_found={bool(seller_ad)}).")
-                continue
+def fetch_both_sides(pair_key, currency, variant, min_threshold, max_threshold, profit_thresh, prev_check=None):
+    """
+    Full-scan fallback for BUY and SELL.
+    When the pair is idle and its buy price was fetched at its previous check (started
+    at `prev_check`), scan BUY first and skip the SELL scan if even that buy price
+    cannot reach the threshold. A skip does not refresh the cached price, so the next
+    check always scans both sides. Returns (buyer_ad, seller_ad, skipped).
+    """
+    state = get_active_state(pair_key)
+    cached_buy = state.last_buy_price
+    fresh = state.last_buy_at is not None and prev_check is not None and state.last_buy_at >= prev_check
+    if not state.active and cached_buy and fresh:
+        buyer_ad = find_first_ad_probed(currency, variant, "BUY", min_threshold, max_threshold)
+        if not buyer_ad:
+            return None, None, False
+        bound = spread_pct(buyer_ad["price"], cached_buy)
+        if bound < profit_thresh - SKIP_SECOND_SIDE_MARGIN_PERCENT:
+            logging.debug("%s: bound spread %.2f%% with cached buy=%s — skipping SELL scan", pair_key, bound, cached_buy)
+            return buyer_ad, None, True
+        seller_ad = find_first_ad_probed(currency, variant, "SELL", min_threshold, max_threshold)
+        return buyer_ad, seller_ad, False
+
+    buyer_ad = None
+    seller_ad = None
+    fut_b = side_pool.submit(find_first_ad_probed, currency, variant, "BUY", min_threshold, max_threshold)
+    fut_s = side_pool.submit(find_first_ad_probed, currency, variant, "SELL", min_threshold, max_threshold)
+    try:
+        buyer_ad = fut_b.result()
+    except Exception as e:
+        logging.debug("buyer fetch error for %s: %s", pair_key, e)
+    try:
+        seller_ad = fut_s.result()
+    except Exception as e:
+        logging.debug("seller fetch error for %s: %s", pair_key, e)
+    return buyer_ad, seller_ad, False
+
+class VariantSpec(NamedTuple):
+    variant: str
+    pair_key: str  # interned "CUR|variant"
+    friendly: str
+    profit_threshold: float
+    lock: object  # the pair's lock, resolved once (specs sharing a pair_key share it)
+
+
+class PairSpec(NamedTuple):
+    """A monitored (currency, method) with its thresholds and variants resolved once at startup."""
+    currency: str
+    method: str
+    min_threshold: float
+    max_threshold: float
+    variants: tuple
+
+
+# (currency, method) -> VariantSpec that last produced ads; tried first next time, the rest stay fallbacks
+preferred_variant = {}
+
+def make_pair_spec(currency, method, min_threshold, max_threshold):
+    variants = []
+    for variant in paytype_variants_map.get(method, [method]):
+        pair_key = sys.intern(f"{currency}|{variant}")
+        variants.append(VariantSpec(variant, pair_key, friendly_pay_names.get(variant, variant),
+                                    get_profit_threshold(currency, variant), get_pair_lock(pair_key)))
+    return PairSpec(currency, method, min_threshold, max_threshold, tuple(variants))
+
+def process_variant(currency, key, min_threshold, max_threshold, vs, prev_check=None):
+    """
+    Scan one variant of a pair and send/record its alerts. Returns (handled, spread):
+    handled is False when the variant produced no usable ads, so the next one is tried.
+    """
+    variant, pair_key, pay_friendly, profit_thresh, lock = vs
+    with lock:
+        now = time.monotonic()
+        buyer_ad = None
+        seller_ad = None
+        try:
+            buyer_ad, seller_ad = fast_probe_ads(currency, variant, min_threshold, max_threshold)
+        except Exception as e:
+            logging.debug("fast_probe failed for %s: %s", pair_key, e)
 
+        if not buyer_ad or not seller_ad:
             try:
-                sell_price = float(buyer_ad["price"])  # price from BUY page (what you can sell at)
-                buy_price = float(seller_ad["price"])  # price from SELL page (what you can buy at)
-                spread_percent = ((sell_price / buy_price) - 1.0) * 100.0
+                buyer_ad, seller_ad, skipped = fetch_both_sides(pair_key, currency, variant, min_threshold, max_threshold, profit_thresh, prev_check)
             except Exception as e:
-                logging.warning(f"Spread calc error for {pair_key}: {e}")
-                continue
+                logging.debug("full scan failed for %s: %s", pair_key, e)
+                buyer_ad, seller_ad, skipped = None, None, False
+            if skipped:
+                # pair stays idle; only refresh the side we actually fetched
+                set_active_state_snapshot(pair_key, last_sell_price=buyer_ad["price"], now=now)
+                return True, None
 
-            profit_thresh = get_profit_threshold(currency, variant)
-            pay_friendly = friendly_pay_names.get(variant, variant)
-            logging.info(f"{pair_key} sell_price(from BUY page)={sell_price:.4f} buy_price(from SELL page)={buy_price:.4f} spread={spread_percent:.2f}% profit_thr={profit_thresh} min_thr={min_threshold} max_thr={max_threshold} min_sell={buyer_ad.get('min_limit',0):.2f} min_buy={seller_ad.get('min_limit',0):.2f} max_sell={buyer_ad.get('max_limit',0):.2f} max_buy={seller_ad.get('max_limit',0):.2f}")
+        logging.debug("[found] %s buyer_ad=%s seller_ad=%s", pair_key, buyer_ad, seller_ad)
 
-            state = get_active_state(pair_key)
-            was_active = state["active"]
-            current_sig = compute_signature(spread_percent, buy_price, sell_price)
+        if not buyer_ad or not seller_ad:
+            logging.debug("%s: missing buyer or seller ad (buyer_found=%s seller_found=%s).", pair_key, bool(buyer_ad), bool(seller_ad))
+            return False, None
 
-            if spread_percent >= profit_thresh:
-                if not was_active:
-                    if not should_send_update(state, spread_percent, buy_price, sell_price, signature=current_sig):
-                        logging.debug(f"{pair_key}: Start suppressed (duplicate values). Marking active without sending.")
-                        set_active_state_snapshot(pair_key, active=True, last_spread=spread_percent,
-                                                  last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False)
-                    else:
-                        if can_send_start(state):
-                            msg = build_alert_message(currency, pay_friendly, seller_ad, buyer_ad, spread_percent)
-                            sent = send_telegram_alert(msg)
-                            if sent:
-                                logging.info(f"Start alert sent for {pair_key} (spread {spread_percent:.2f}%)")
-                                set_active_state_snapshot(pair_key, active=True, last_spread=spread_percent,
-                                                          last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=True, last_sent_signature=current_sig, last_message_type='start')
-                            else:
-                                logging.warning(f"Failed to send start alert for {pair_key}")
-                        else:
-                            logging.debug(f"Start suppressed by TTL for {pair_key}")
-                            set_active_state_snapshot(pair_key, active=True, last_spread=spread_percent,
-                                                      last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False)
+        try:
+            sell_price = float(buyer_ad["price"])  # price from BUY page (what you can sell at)
+            buy_price = float(seller_ad["price"])  # price from SELL page (what you can buy at)
+            spread_percent = spread_pct(sell_price, buy_price)
+        except Exception as e:
+            logging.warning(f"Spread calc error for {pair_key}: {e}")
+            return False, None
+
+        logging.info("%s sell_price(from BUY page)=%.4f buy_price(from SELL page)=%.4f spread=%.2f%% profit_thr=%s min_thr=%s max_thr=%s min_sell=%.2f min_buy=%.2f max_sell=%.2f max_buy=%.2f",
+                     pair_key, sell_price, buy_price, spread_percent, profit_thresh, min_threshold, max_threshold,
+                     buyer_ad.get('min_limit', 0), seller_ad.get('min_limit', 0), buyer_ad.get('max_limit', 0), seller_ad.get('max_limit', 0))
+
+        state = get_active_state(pair_key)
+        was_active = state.active
+        current_sig = compute_signature(spread_percent, buy_price, sell_price)
+
+        if spread_percent >= profit_thresh:
+            if not was_active:
+                if not should_send_update(state, spread_percent, buy_price, sell_price, signature=current_sig):
+                    logging.debug("%s: Start suppressed (duplicate values). Marking active without sending.", pair_key)
+                    set_active_state_snapshot(pair_key, active=True, last_spread=spread_percent,
+                                              last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False, now=now)
                 else:
-                    if should_send_update(state, spread_percent, buy_price, sell_price, signature=current_sig):
-                        msg = build_update_message(currency, pay_friendly, seller_ad, buyer_ad, spread_percent)
-                        sent = send_telegram_alert(msg)
-                        if sent:
-                            logging.info(f"Update alert sent for {pair_key} (spread {spread_percent:.2f}%)")
-                            set_active_state_snapshot(pair_key, active=True, last_spread=spread_percent,
-                                                      last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=True, last_sent_signature=current_sig, last_message_type='update')
-                        else:
-                            logging.warning(f"Failed to send update for {pair_key}")
+                    if can_send_start(state, now):
+                        msg = build_alert_message(currency, pay_friendly, seller_ad, buyer_ad, spread_percent)
+                        dispatch_alert(pair_key, 'start', msg, spread_percent, active=True, last_spread=spread_percent,
+                                       last_buy_price=buy_price, last_sell_price=sell_price, last_sent_signature=current_sig)
                     else:
+                        logging.debug("Start suppressed by TTL for %s", pair_key)
                         set_active_state_snapshot(pair_key, active=True, last_spread=spread_percent,
-                                                  last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False)
+                                                  last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False, now=now)
             else:
-                if was_active:
-                    if should_send_update(state, spread_percent, buy_price, sell_price, signature=current_sig):
-                        msg = build_end_message(currency, pay_friendly, seller_ad, buyer_ad, spread_percent)
-                        sent = send_telegram_alert(msg)
-                        if sent:
-                            logging.info(f"End alert sent for {pair_key} (spread {spread_percent:.2f}%)")
-                            set_active_state_snapshot(pair_key, active=False, last_spread=spread_percent,
-                                                      last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=True, last_sent_signature=current_sig, last_message_type='end')
-                        else:
-                            logging.warning(f"Failed to send end alert for {pair_key}")
-                    else:
-                        logging.debug(f"{pair_key}: End suppressed (duplicate values). Marking inactive without sending.")
-                        set_active_state_snapshot(pair_key, active=False, last_spread=spread_percent,
-                                                  last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False)
+                if should_send_update(state, spread_percent, buy_price, sell_price, signature=current_sig):
+                    msg = build_update_message(currency, pay_friendly, seller_ad, buyer_ad, spread_percent)
+                    dispatch_alert(pair_key, 'update', msg, spread_percent, active=True, last_spread=spread_percent,
+                                   last_buy_price=buy_price, last_sell_price=sell_price, last_sent_signature=current_sig)
+                else:
+                    set_active_state_snapshot(pair_key, active=True, last_spread=spread_percent,
+                                              last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False, now=now)
+        else:
+            if was_active:
+                if should_send_update(state, spread_percent, buy_price, sell_price, signature=current_sig):
+                    msg = build_end_message(currency, pay_friendly, seller_ad, buyer_ad, spread_percent)
+                    dispatch_alert(pair_key, 'end', msg, spread_percent, active=False, last_spread=spread_percent,
+                                   last_buy_price=buy_price, last_sell_price=sell_price, last_sent_signature=current_sig)
                 else:
+                    logging.debug("%s: End suppressed (duplicate values). Marking inactive without sending.", pair_key)
                     set_active_state_snapshot(pair_key, active=False, last_spread=spread_percent,
-                                              last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False)
-
-        break  # only process first matching variant
+                                              last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False, now=now)
+            else:
+                set_active_state_snapshot(pair_key, active=False, last_spread=spread_percent,
+                                          last_buy_price=buy_price, last_sell_price=sell_price, mark_sent=False, now=now)
+
+        # queued start alerts are not applied to state yet, so judge "live" by the threshold
+        pair_live[key] = spread_percent >= profit_thresh
+
+    return True, spread_percent
+
+
+def process_pair(spec):
+    """Scan and alert for one pair. Returns the spread of the processed variant, or None."""
+    currency, method, min_threshold, max_threshold, variants = spec
+    key = (currency, method)
+    spread_percent = None
+    t0 = time.perf_counter()
+    prev_check = pair_checked_at.get(key)
+    pair_checked_at[key] = time.monotonic()
+    preferred = preferred_variant.get(key)
+    if preferred is not None and preferred is not variants[0]:
+        variants = (preferred,) + tuple(v for v in variants if v is not preferred)
+    for i, vs in enumerate(variants):
+        handled, spread_percent = process_variant(currency, key, min_threshold, max_threshold, vs, prev_check)
+        if handled:
+            preferred_variant[key] = vs
+            # variants not reached this tick but still carrying a live alert keep being
+            # scanned, so they can still send their End alert
+            for other in variants[i + 1:]:
+                if get_active_state(other.pair_key).active:
+                    live = pair_live.get(key, False)
+                    process_variant(currency, key, min_threshold, max_threshold, other, prev_check)
+                    pair_live[key] = live or pair_live.get(key, False)
+            break  # only process first matching variant
+        if vs is preferred:
+            preferred_variant.pop(key, None)
+    pair_latency[key] = 0.7 * pair_latency.get(key, 1.0) + 0.3 * (time.perf_counter() - t0)
+    return spread_percent
 
 # ---------------------- main loop ----------------------
 
@@ -898,7 +1600,7 @@ def build_pairs_to_monitor():
                 logging.error(f"No methods for {cur}. Exiting.")
                 raise SystemExit(1)
             if SELECTED_METHOD and SELECTED_METHOD.upper() != "ALL":
-                if SELECTED_METHOD not in methods:
+                if SELECTED_METHOD not in payment_methods_index.get(cur, frozenset()):
                     logging.error(f"Method {SELECTED_METHOD} not valid for {cur}. Exiting.")
                     raise SystemExit(1)
                 methods = [SELECTED_METHOD]
@@ -907,41 +1609,69 @@ def build_pairs_to_monitor():
                 maxthr = max_limit_thresholds.get(cur, DEFAULT_MAX_LIMIT)
                 local_pairs.append((cur, m, minthr, maxthr))
 
-    # apply whitelist/exclude filters
-    filtered = []
-    for cur, m, minthr, maxthr in local_pairs:
-        if not method_allowed(m):
-            logging.debug(f"Filtered out {cur}|{m} by PAYMENT_METHODS/EXCLUDE settings")
-            continue
-        filtered.append((cur, m, minthr, maxthr))
+    # apply whitelist/exclude filters (decided once per distinct method)
+    allowed = {m: method_allowed(m) for m in {p[1] for p in local_pairs}}
+    for cur, m, _, _ in local_pairs:
+        if not allowed[m]:
+            logging.debug("Filtered out %s|%s by PAYMENT_METHODS/EXCLUDE settings", cur, m)
+    filtered = tuple(p for p in local_pairs if allowed[p[1]])
     if not filtered:
         logging.error("No currency/payment pairs selected after applying PAYMENT_METHODS filter. Exiting.")
         raise SystemExit(1)
     return filtered
 
 pairs_to_monitor = build_pairs_to_monitor()
+monitored_pairs = tuple(make_pair_spec(cur, m, minthr, maxthr) for cur, m, minthr, maxthr in pairs_to_monitor)
+
+# (currency, method) -> last observed spread / EWMA of |Δspread| between checks
+last_spreads = {}
+pair_volatility = {}
+
+def next_check_delay(key, spread):
+    """Seconds until a pair is due again: volatile pairs are rechecked sooner."""
+    if spread is not None:
+        prev = last_spreads.get(key)
+        if prev is not None:
+            pair_volatility[key] = VOLATILITY_EWMA_ALPHA * abs(spread - prev) + (1.0 - VOLATILITY_EWMA_ALPHA) * pair_volatility.get(key, 0.0)
+        last_spreads[key] = spread
+    delay = REFRESH_EVERY * math.exp(-pair_volatility.get(key, 0.0))
+    return min(MAX_REFRESH_SECONDS, max(MIN_REFRESH_SECONDS, delay))
 
 def run_monitor_loop():
-    logging.info(f"Monitoring {len(pairs_to_monitor)} pairs. Every {REFRESH_EVERY}s. Workers={MAX_CONCURRENT_WORKERS} RPM={REQUESTS_PER_MINUTE}")
+    logging.info(f"Monitoring {len(pairs_to_monitor)} pairs. Every {REFRESH_EVERY}s (adaptive {MIN_REFRESH_SECONDS:.0f}-{MAX_REFRESH_SECONDS:.0f}s). Workers={MAX_CONCURRENT_WORKERS} RPM={REQUESTS_PER_MINUTE}")
+    seq = itertools.count()  # heap tie-breaker; PairSpec ordering is irrelevant
+    now = time.monotonic()
+    due = [(now, next(seq), spec) for spec in monitored_pairs]
+    heapq.heapify(due)
     try:
         while True:
-            start_ts = time.time()
-
-            futures = []
-            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS) as ex:
-                for cur, m, minthr, maxthr in pairs_to_monitor:
-                    futures.append(ex.submit(process_pair, cur, m, minthr, maxthr))
-                    time.sleep(SLEEP_BETWEEN_PAIRS)
-
-                for f in as_completed(futures):
-                    try:
-                        f.result()
-                    except Exception as e:
-                        logging.error(f"Proc error: {e}")
-
-            elapsed = time.time() - start_ts
-            sleep_for = max(0, REFRESH_EVERY - elapsed)
-            logging.debug(f"Cycle done in {elapsed:.2f}s, sleeping {sleep_for:.2f}s until next cycle")
+            start_ts = time.monotonic()
+            batch = []
+            while due and due[0][0] <= start_ts:
+                batch.append(heapq.heappop(due)[2])
+
+            # live alerts first, so they are not starved on a saturated pool
+            batch.sort(key=schedule_key)
+
+            futures = {pair_pool.submit(process_pair, spec): spec for spec in batch}
+            for f in as_completed(futures):
+                spec = futures[f]
+                try:
+                    spread = f.result()
+                except Exception as e:
+                    logging.error(f"Proc error: {e}")
+                    spread = None
+                delay = next_check_delay((spec.currency, spec.method), spread)
+                heapq.heappush(due, (time.monotonic() + delay, next(seq), spec))
+
+            flush_alerts()
+            prune_state()
+
+            elapsed = time.monotonic() - start_ts
+            sleep_for = max(0, due[0][0] - time.monotonic())
+            # a steadily growing connection count means the pool is churning (TLS handshakes)
+            logging.debug("Cycle done (%d pairs) in %.2fs, sleeping %.2fs until next pair is due (binance connections opened=%d)",
+                          len(batch), elapsed, sleep_for, binance_pool.num_connections)
             time.sleep(sleep_for)
     except KeyboardInterrupt:
         logging.info("Stopped by user.")
@@ -950,6 +1680,7 @@ def run_monitor_loop():
 
 
 def start_worker():
+    warm_connections()
     run_monitor_loop()
 
 
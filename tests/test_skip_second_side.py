@@ -0,0 +1,36 @@
+import threading
+from collections import defaultdict
+
+import arbitrage_bot as ab
+
+
+def test_sell_skip_uses_only_the_previous_checks_buy_price(monkeypatch):
+    """Run the real monitor loop: a calm pair alternates full scans and BUY-only checks."""
+    spec = ab.make_pair_spec("USD", "NETELLER", 100.0, 0.0)
+    key = (spec.currency, spec.method)
+    ticks = defaultdict(list)  # check start -> sides searched during that check
+    lock = threading.Lock()
+
+    def probed(fiat, pay_type, trade_type, min_thr, max_thr=None):
+        with lock:
+            ticks[ab.pair_checked_at[key]].append(trade_type)
+            if len(ticks) > 6:
+                raise KeyboardInterrupt  # stops run_monitor_loop through its normal exit path
+        # BUY page 90 vs SELL page 100: -10%, far below the threshold on every tick
+        price = 90.0 if trade_type == "BUY" else 100.0
+        return {"price": price, "payment_method": pay_type, "min_limit": 1.0, "max_limit": 1e9, "advertiser": "x"}
+
+    monkeypatch.setattr(ab, "monitored_pairs", (spec,))
+    monkeypatch.setattr(ab, "fast_probe_ads", lambda *a: (None, None))
+    monkeypatch.setattr(ab, "find_first_ad_probed", probed)
+    monkeypatch.setattr(ab, "REFRESH_EVERY", 0.05)
+    monkeypatch.setattr(ab, "MIN_REFRESH_SECONDS", 0.05)
+    monkeypatch.setattr(ab, "MAX_REFRESH_SECONDS", 0.05)
+
+    loop = threading.Thread(target=ab.run_monitor_loop, daemon=True)
+    loop.start()
+    loop.join(timeout=10)
+    assert not loop.is_alive()
+
+    sides = [sorted(ticks[t]) for t in sorted(ticks)][:6]
+    assert sides == [["BUY", "SELL"], ["BUY"]] * 3